@@ -1,65 +1,223 @@
 import os
+import re
+import sys
+import io
+import json
+import atexit
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import time
+import random
+import unicodedata
+import asyncio
 import shutil
+import tempfile
 import warnings
-import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from functools import lru_cache
+from pathlib import Path
+from urllib.parse import quote
 warnings.filterwarnings("ignore")
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
-from pydantic import BaseModel
-from PIL import Image
+from pydantic import BaseModel, ConfigDict, Field
+from PIL import Image, ImageSequence
 from pdf2docx import Converter
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# In-memory cache for chatbot responses
-response_cache = {}
+# Logging goes through a queue so the actual stdout writes happen on a
+# listener thread instead of the request path
+log = logging.getLogger("portfolio_backend")
+_log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+# getLevelName returns an int only for known level names
+if not isinstance(logging.getLevelName(_log_level), int):
+    _log_level = "INFO"
+log.setLevel(_log_level)
+log.propagate = False
+_log_queue = queue.Queue(-1)
+log.addHandler(QueueHandler(_log_queue))
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# In-memory LRU cache for chatbot responses
+response_cache = OrderedDict()
 MAX_CACHE_SIZE = 100  # Limit cache to 100 entries
 
 active_model = None
+model_from_cache = False
+
+# Knowledge base and guidelines, registered once as the model's system
+# instruction so only the user message is sent per request
+SYSTEM_INSTRUCTION = """
+You are the AI assistant for Senal Ridmila's Personal Portfolio.
+Your goal is to answer visitor questions in a friendly, "Singlish" (Sinhala words in English) style.
+
+--- SENAL'S DATA (KNOWLEDGE BASE) ---
+
+1. WHO IS SENAL?
+   - Name: Senal Ridmila
+   - Role: Undergraduate Student & Full Stack Developer
+   - Education: BSc (Hons) in Network and Mobile Computing at Horizon Campus.
+   - Passion: Software development, working under pressure, and learning new tech.
+
+2. SKILLS (Mewa gana ahuwoth kiyanna):
+   - Languages: Java (OOP), JavaScript, Python, PHP
+   - Frameworks: Spring Boot, React.js, Next.js, Node.js, React Native (Expo)
+   - Databases: MySQL, MongoDB
+   - Tools: Docker, Git, VS Code, Firebase
+
+3. KEY PROJECTS (Wada karapu projects):
+   - Ayurveda Wellness App: A mobile app for connecting patients with Ayurvedic doctors (React Native, Firebase).
+   - Pet Toy Shop: E-commerce platform built with Spring Boot, React, and MongoDB (Full Stack).
+   - Car Rental System: Java Swing and MySQL based system for managing rentals.
+   - Virtual Fitting App: A virtual try-on experience using Next.js and Tailwind CSS.
+   - SLT Tire Management: Tire request system using React and Java.
+
+4. CONTACT DETAILS:
+   - Phone: +94 781304930 , +9477 1304930
+   - Email: senalridmila2@gmail.com
+   - LinkedIn: linkedin.com/in/senal-ridmila-98b996292
+   - GitHub: github.com/SenalRidmila
+
+--- GUIDELINES FOR ANSWERING ---
+
+1. Tone: Friendly, casual, and helpful. Use Singlish words like "Kohomada", "Ow", "Puluwan", "Thiyenawa", "Hari".
+2. If user says "Hi" or "Hello": Reply "Hi! Kohomada? Senal gana wisthara ona nam ahanna."
+3. If asked about "Skills": Mention his Java, React, and Spring Boot skills mainly.
+4. If asked about "Education": Say he is studying at Horizon Campus.
+5. If asked about "Contact": Give the email and LinkedIn link.
+6. Keep answers short (max 2-3 sentences). Don't write long essays.
+"""
+
+# Models known to accept system_instruction, in order of preference, with the
+# max_output_tokens each needs for a 2-3 sentence reply. Gemini 2.5 Flash
+# "thinks" by default and its thinking tokens count against the limit.
+SUPPORTED_MODELS = {
+    "models/gemini-2.0-flash": 150,
+    "models/gemini-2.0-flash-lite": 150,
+    "models/gemini-2.5-flash-lite": 150,
+    "models/gemini-2.5-flash": 2048,
+}
+
+
+def build_model(model_name):
+    return genai.GenerativeModel(
+        model_name,
+        system_instruction=SYSTEM_INSTRUCTION,
+        generation_config={
+            "max_output_tokens": SUPPORTED_MODELS[model_name],
+            "temperature": 0.7,
+        },
+    )
+
+
+# Resolved model name is cached on disk so restarts can skip list_models()
+MODEL_CACHE_FILE = Path(__file__).with_name(".model_cache.json")
+MODEL_CACHE_TTL = 24 * 60 * 60  # seconds
+
+
+def load_cached_model_name():
+    try:
+        meta = json.loads(MODEL_CACHE_FILE.read_text())
+        if time.time() - meta["ts"] < MODEL_CACHE_TTL and meta["name"] in SUPPORTED_MODELS:
+            return meta["name"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_cached_model_name(name):
+    try:
+        MODEL_CACHE_FILE.write_text(json.dumps({"ts": time.time(), "name": name}))
+    except OSError as e:
+        log.warning("🔴 Could not write model cache: %s", e)
 
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    
 
-    print("🔄 Checking available models...")
+def discover_model_name():
+    log.info("🔄 Checking available models...")
     available_models = []
     for m in genai.list_models():
         if 'generateContent' in m.supported_generation_methods:
             available_models.append(m.name)
-    
 
-    target_models = ["models/gemini-1.5-flash", "models/gemini-pro", "models/gemini-1.5-pro"]
-    selected_model_name = None
+    # Only pick from the allowlist; other models may reject system_instruction
+    for target in SUPPORTED_MODELS:
+        if target in available_models:
+            return target
+    return None
+
+
+def refresh_model():
+    """Drop the on-disk model cache and pick a model again via list_models()"""
+    global active_model, model_from_cache
+    MODEL_CACHE_FILE.unlink(missing_ok=True)
+    model_from_cache = False
+    name = discover_model_name()
+    if name:
+        save_cached_model_name(name)
+        log.info("✅ Selected Model: %s", name)
+        active_model = build_model(name)
+    else:
+        log.error("🔴 No supported models found for this API Key.")
+        active_model = None
 
 
-    for target in target_models:
-        if target in available_models:
-            selected_model_name = target
-            break
-    
+try:
+    genai.configure(api_key=GEMINI_API_KEY)
 
-    if not selected_model_name and available_models:
-        selected_model_name = available_models[0]
+    selected_model_name = load_cached_model_name()
+    model_from_cache = selected_model_name is not None
+    if not selected_model_name:
+        selected_model_name = discover_model_name()
+        if selected_model_name:
+            save_cached_model_name(selected_model_name)
 
     if selected_model_name:
-        print(f"✅ Selected Model: {selected_model_name}")
-        active_model = genai.GenerativeModel(selected_model_name)
+        log.info("✅ Selected Model: %s", selected_model_name)
+        active_model = build_model(selected_model_name)
     else:
-        print("🔴 No supported models found for this API Key.")
+        log.error("🔴 No supported models found for this API Key.")
 
 except Exception as e:
-    print(f"🔴 Setup Error: {e}")
+    log.error("🔴 Setup Error: %s", e)
+
+WARMUP_TIMEOUT = 10  # seconds
+
+
+async def warm_up_model():
+    """Open the Gemini connection before the first real /chat request"""
+    try:
+        await asyncio.wait_for(
+            active_model.generate_content_async(
+                "ping", generation_config={"max_output_tokens": 1}
+            ),
+            timeout=WARMUP_TIMEOUT,
+        )
+    except Exception as e:
+        log.warning("🔴 Model warm-up failed: %s", e)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Warm up in the background so a slow API does not hold up startup
+    warmup_task = asyncio.create_task(warm_up_model()) if active_model else None
+    yield
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
 
-# Add compression middleware for faster responses
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -69,137 +227,251 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-os.makedirs("temp_uploads", exist_ok=True)
-os.makedirs("temp_outputs", exist_ok=True)
+UPLOAD_DIR = Path("temp_uploads")
+OUTPUT_DIR = Path("temp_outputs")
+UPLOAD_DIR.mkdir(exist_ok=True)
+OUTPUT_DIR.mkdir(exist_ok=True)
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB copy buffer for uploaded files
+
+
+def _temp_path(directory, suffix=""):
+    """Create a collision-free empty file in directory and return its path"""
+    fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    os.close(fd)
+    return Path(path)
+
+
+def _remove_files(*paths):
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def _attachment_headers(filename):
+    # Same Content-Disposition encoding FileResponse uses
+    quoted = quote(filename)
+    if quoted != filename:
+        return {"Content-Disposition": f"attachment; filename*=utf-8''{quoted}"}
+    return {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+
+def _save_upload(src, path):
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(src, buffer, UPLOAD_CHUNK_SIZE)
+
+
+IMAGE_FORMATS = ["JPEG", "PNG", "WEBP", "BMP", "GIF", "TIFF"]
+MULTI_FRAME_FORMATS = ("GIF", "TIFF")
+MAX_PDF_PAGES = 50  # frames accepted from an animated GIF / multi-page TIFF
+
 
+def _convert_image_to_pdf(src):
+    """Convert an image to PDF in memory and return the PDF bytes"""
+    out = io.BytesIO()
+    image = Image.open(src, formats=IMAGE_FORMATS)
+
+    # JPEGs with an MPF segment also report n_frames > 1, so check the format
+    n_frames = getattr(image, "n_frames", 1)
+    if image.format in MULTI_FRAME_FORMATS and n_frames > 1:
+        if n_frames > MAX_PDF_PAGES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image has {n_frames} frames; at most {MAX_PDF_PAGES} are supported.",
+            )
+        # Animated GIF / multi-page TIFF: one PDF page per frame, single save
+        frames = [frame.convert('RGB') for frame in ImageSequence.Iterator(image)]
+        frames[0].save(out, 'PDF', save_all=True, append_images=frames[1:])
+        return out.getvalue()
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    # Explicit format skips extension-based lookup
+    image.save(out, 'PDF')
+    return out.getvalue()
+
+
+def _convert_pdf_to_docx(in_path, out_path):
+    cv = Converter(in_path)
+    cv.convert(out_path, start=0, end=None)
+    cv.close()
+
+
+def _punctuation_pattern():
+    """Character class of BMP punctuation and symbols, minus + and # (C++, C#)"""
+    ranges = []
+    start = None
+    for code in range(0x10000):
+        char = chr(code)
+        if unicodedata.category(char)[0] in "PS" and char not in "+#":
+            if start is None:
+                start = code
+        elif start is not None:
+            ranges.append(f"{re.escape(chr(start))}-{re.escape(chr(code - 1))}")
+            start = None
+    if start is not None:
+        ranges.append(f"{re.escape(chr(start))}-{re.escape(chr(0xFFFF))}")
+    return re.compile("[" + "".join(ranges) + "]")
+
+
+# Built from Unicode categories rather than [^\w\s], which would also strip
+# combining marks such as Sinhala and Tamil vowel signs
+_PUNCTUATION_RE = _punctuation_pattern()
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Small-talk answered directly without calling Gemini
+GREETING_REPLY = "Hi! Kohomada? Senal gana wisthara ona nam ahanna."
+CANNED_REPLIES = {
+    "hi": GREETING_REPLY,
+    "hello": GREETING_REPLY,
+    "hey": GREETING_REPLY,
+    "kohomada": GREETING_REPLY,
+}
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _WHITESPACE_RE.sub(" ", _PUNCTUATION_RE.sub("", message.lower())).strip()
 
 
 def get_cache_key(message: str) -> str:
-    """Generate a cache key from the message"""
-    return hashlib.md5(message.lower().strip().encode()).hexdigest()
+    """Generate a cache key from the message (the normalized text itself)"""
+    return normalize_message(message)
+
 
+# A cached model name that now fails with these is stale (retired model or new key)
+STALE_MODEL_ERRORS = (google_exceptions.NotFound, google_exceptions.PermissionDenied)
+model_refresh_lock = asyncio.Lock()
+
+
+async def generate_content(prompt):
+    model = active_model
+    try:
+        return await model.generate_content_async(prompt)
+    except STALE_MODEL_ERRORS as e:
+        if not model_from_cache and model is active_model:
+            raise
+        async with model_refresh_lock:
+            # Only the first caller to hit the stale model rediscovers
+            if model is active_model:
+                log.warning("🔴 Cached model failed (%s), rediscovering", e)
+                await asyncio.to_thread(refresh_model)
+        if not active_model:
+            raise
+        return await active_model.generate_content_async(prompt)
+
+
+# Bound in-flight Gemini calls and retry quota/availability errors
+GEMINI_MAX_CONCURRENCY = 20
+GEMINI_MAX_RETRIES = 3
+GEMINI_RETRY_BASE_DELAY = 0.5  # seconds
+GEMINI_SEM = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+RETRYABLE_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)
+
+
+async def generate_limited(prompt):
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        try:
+            async with GEMINI_SEM:
+                return await generate_content(prompt)
+        except RETRYABLE_ERRORS as e:
+            if attempt == GEMINI_MAX_RETRIES:
+                raise
+            # Exponential backoff with full jitter, outside the semaphore
+            delay = random.uniform(0, GEMINI_RETRY_BASE_DELAY * 2 ** attempt)
+            log.warning("🔴 Gemini busy (%s), retrying in %.2fs", e, delay)
+            await asyncio.sleep(delay)
+
+
+async def get_ai_response(user_message):
+    cache_key = get_cache_key(user_message)
+    if cache_key in CANNED_REPLIES:
+        return CANNED_REPLIES[cache_key]
 
-def get_ai_response(user_message):
     if not active_model:
         return "Server Error: No AI model available."
 
-    # Check cache first
-    cache_key = get_cache_key(user_message)
-    if cache_key in response_cache:
-        print(f"✅ Cache hit for: {user_message[:30]}...")
+    # Check cache first (punctuation-only messages have no usable key)
+    if cache_key and cache_key in response_cache:
+        log.debug("✅ Cache hit for: %s...", user_message[:30])
+        response_cache.move_to_end(cache_key)
         return response_cache[cache_key]
 
     try:
-        
-        prompt = f"""
-        You are the AI assistant for Senal Ridmila's Personal Portfolio.
-        Your goal is to answer visitor questions in a friendly, "Singlish" (Sinhala words in English) style.
-        
-        --- SENAL'S DATA (KNOWLEDGE BASE) ---
-        
-        1. WHO IS SENAL?
-           - Name: Senal Ridmila
-           - Role: Undergraduate Student & Full Stack Developer
-           - Education: BSc (Hons) in Network and Mobile Computing at Horizon Campus.
-           - Passion: Software development, working under pressure, and learning new tech.
-           
-        2. SKILLS (Mewa gana ahuwoth kiyanna):
-           - Languages: Java (OOP), JavaScript, Python, PHP
-           - Frameworks: Spring Boot, React.js, Next.js, Node.js, React Native (Expo)
-           - Databases: MySQL, MongoDB
-           - Tools: Docker, Git, VS Code, Firebase
-           
-        3. KEY PROJECTS (Wada karapu projects):
-           - Ayurveda Wellness App: A mobile app for connecting patients with Ayurvedic doctors (React Native, Firebase).
-           - Pet Toy Shop: E-commerce platform built with Spring Boot, React, and MongoDB (Full Stack).
-           - Car Rental System: Java Swing and MySQL based system for managing rentals.
-           - Virtual Fitting App: A virtual try-on experience using Next.js and Tailwind CSS.
-           - SLT Tire Management: Tire request system using React and Java.
-           
-        4. CONTACT DETAILS:
-           - Phone: +94 781304930 , +9477 1304930
-           - Email: senalridmila2@gmail.com
-           - LinkedIn: linkedin.com/in/senal-ridmila-98b996292
-           - GitHub: github.com/SenalRidmila
-
-        --- GUIDELINES FOR ANSWERING ---
-        
-        1. Tone: Friendly, casual, and helpful. Use Singlish words like "Kohomada", "Ow", "Puluwan", "Thiyenawa", "Hari".
-        2. If user says "Hi" or "Hello": Reply "Hi! Kohomada? Senal gana wisthara ona nam ahanna."
-        3. If asked about "Skills": Mention his Java, React, and Spring Boot skills mainly.
-        4. If asked about "Education": Say he is studying at Horizon Campus.
-        5. If asked about "Contact": Give the email and LinkedIn link.
-        6. Keep answers short (max 2-3 sentences). Don't write long essays.
-
-        --- CONVERSATION ---
-        User: {user_message}
-        AI:
-        """
-
-        response = active_model.generate_content(prompt)
+        response = await generate_limited(user_message)
         
         if response and response.text:
             reply = response.text.strip()
             
             # Cache the response
-            if len(response_cache) >= MAX_CACHE_SIZE:
-                # Remove oldest entry (simple FIFO)
-                response_cache.pop(next(iter(response_cache)))
-            response_cache[cache_key] = reply
-            print(f"💾 Cached response for: {user_message[:30]}...")
+            if cache_key:
+                response_cache[cache_key] = reply
+                response_cache.move_to_end(cache_key)
+                if len(response_cache) > MAX_CACHE_SIZE:
+                    # Remove least recently used entry
+                    response_cache.popitem(last=False)
+                log.debug("💾 Cached response for: %s...", user_message[:30])
             
             return reply
         else:
             return "Samawenna, mata kiyanna deyak hithaganna ba."
 
     except Exception as e:
-        print(f"🔴 Gemini Error: {e}")
+        log.error("🔴 Gemini Error: %s", e)
         return "Samawenna, podi aulak. Internet connection eka balanna."
 
 
 
 
+MAX_MESSAGE_LENGTH = 4000
+
+
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
+    message: str = Field(min_length=1, max_length=MAX_MESSAGE_LENGTH)
+
+
+class ChatResponse(BaseModel):
+    reply: str
+
+
+class StatusResponse(BaseModel):
     message: str
 
+
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
-    reply = get_ai_response(request.message)
-    return {"reply": reply}
+async def chat_endpoint(request: ChatRequest) -> ChatResponse:
+    reply = await get_ai_response(request.message)
+    return ChatResponse(reply=reply)
 
 
 
 @app.post("/tools/img-to-pdf")
 async def img_to_pdf(file: UploadFile = File(...)):
+    output_filename = f"{Path(file.filename).stem}.pdf"
     try:
-        input_path = f"temp_uploads/{file.filename}"
-        output_filename = f"{file.filename.split('.')[0]}.pdf"
-        output_path = f"temp_outputs/{output_filename}"
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        image = Image.open(input_path)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        image.save(output_path)
-        return FileResponse(output_path, filename=output_filename, media_type='application/pdf')
+        data = io.BytesIO(await file.read())
+        pdf_bytes = await asyncio.to_thread(_convert_image_to_pdf, data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=pdf_bytes, media_type='application/pdf', headers=_attachment_headers(output_filename))
 
 @app.post("/tools/pdf-to-word")
-async def pdf_to_word(file: UploadFile = File(...)):
+async def pdf_to_word(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    output_filename = f"{Path(file.filename).stem}.docx"
+    input_path = _temp_path(UPLOAD_DIR, ".pdf")
+    output_path = _temp_path(OUTPUT_DIR, ".docx")
     try:
-        input_path = f"temp_uploads/{file.filename}"
-        output_filename = f"{file.filename.split('.')[0]}.docx"
-        output_path = f"temp_outputs/{output_filename}"
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        cv = Converter(input_path)
-        cv.convert(output_path, start=0, end=None)
-        cv.close()
-        return FileResponse(output_path, filename=output_filename, media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+        await asyncio.to_thread(_save_upload, file.file, input_path)
+        await asyncio.to_thread(_convert_pdf_to_docx, str(input_path), str(output_path))
     except Exception as e:
+        _remove_files(input_path, output_path)
         raise HTTPException(status_code=500, detail=str(e))
+    background_tasks.add_task(_remove_files, input_path, output_path)
+    return FileResponse(output_path, filename=output_filename, media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
 
 @app.get("/")
-def home():
-    return {"message": "Chatbot Backend is Running!"}
\ No newline at end of file
+def home() -> StatusResponse:
+    return StatusResponse(message="Chatbot Backend is Running!")
\ No newline at end of file